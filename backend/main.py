@@ -1,47 +1,186 @@
 import os
 import sys
-import subprocess
+import io
+import asyncio
+import codecs
+import functools
+import hashlib
+import multiprocessing
+import re
 import tempfile
-import json
 import time
-import base64
+import threading
+import traceback
+import uuid
+from collections import OrderedDict, defaultdict
+from contextlib import redirect_stdout, redirect_stderr
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional, List
+from types import CodeType
+from typing import Optional, List, Dict
 
-import pandas as pd
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import aiofiles
+import matplotlib
+import openpyxl
+import orjson
+from cachetools import TTLCache
+from charset_normalizer import from_bytes
+from anyio import to_thread
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+try:
+    import pybase64 as base64  # SIMD-accelerated drop-in for the stdlib module
+    _b64encode_str = base64.b64encode_as_string  # Encodes straight to str
+except ImportError:
+    import base64
+
+    def _b64encode_str(data: bytes) -> str:
+        return base64.b64encode(data).decode('ascii')
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
 # Load environment variables
 load_dotenv()
 
+# Non-interactive matplotlib backend, set once at import (also in each pool worker).
+# pandas display options are applied when pandas is first loaded (see _pd)
+matplotlib.use('Agg')
+
+
+@functools.lru_cache(maxsize=None)
+def _pd():
+    """
+    Import pandas on first use and apply the display options once. The server only
+    needs it for notebook cells and upload previews, so startup doesn't pay for it.
+    """
+    import pandas as pd
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', 1000)  # Wide enough for most terminals
+    pd.set_option('display.max_colwidth', None)
+    return pd
+
+
 # Initialize FastAPI
-app = FastAPI(title="Python Playground API", version="1.0.0")
+# orjson is much faster than json.dumps on large stdout strings and graph payloads,
+# and writes NaN as null, so DataFrame previews need no object-dtype conversion
+app = FastAPI(
+    title="Python Playground API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # CORS middleware - Restrict origins in production
-ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:3000").split(",")
+# A set, since the middleware checks membership on every request; entries may be
+# written "a, b" in .env. ALLOWED_ORIGIN_REGEX can match whole families of origins
+ALLOWED_ORIGINS = frozenset(
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:3000").split(",")
+    if origin.strip()
+)
+ALLOWED_ORIGIN_REGEX = os.getenv("ALLOWED_ORIGIN_REGEX") or None
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
+    allow_origin_regex=ALLOWED_ORIGIN_REGEX,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
 )
 
+# Compress larger responses (long stdout, base64 graphs, previews)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Configuration
 CODE_TIMEOUT = int(os.getenv("CODE_TIMEOUT", "120"))  # Increased to 120 seconds for graphs
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB default
+MAX_OUTPUT_SIZE = int(os.getenv("MAX_OUTPUT_SIZE", "1000000"))  # Characters kept per stream
+
+# Crop figures to their tight bounding box (costs an extra layout pass per figure)
+GRAPH_TIGHT_BBOX = os.getenv("GRAPH_TIGHT_BBOX", "1").lower() not in ("0", "false", "no")
+
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read per chunk when streaming uploads to disk
+# Copy spooled uploads with os.sendfile; Linux only, since macOS sendfile(2) only writes to sockets
+SENDFILE_UPLOADS = sys.platform.startswith('linux') and hasattr(os, 'sendfile')
+ENCODING_SAMPLE_SIZE = 64 * 1024  # Bytes of a CSV sampled to detect its encoding
+
+# Directory for uploads (point at tmpfs/SSD via UPLOAD_DIR)
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", str(Path(tempfile.gettempdir()) / "python_playground_uploads"))).resolve()
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+# Notebook session storage - maintains execution context for each notebook.
+# Bounded LRU with idle expiry so abandoned notebooks don't hold their data forever.
+MAX_NOTEBOOK_SESSIONS = int(os.getenv("MAX_NOTEBOOK_SESSIONS", "256"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))  # Seconds since last run
+SESSION_GC_INTERVAL = 60  # Seconds between sweeps for expired sessions
 
-# Temporary directory for uploads
-UPLOAD_DIR = Path(tempfile.gettempdir()) / "python_playground_uploads"
-UPLOAD_DIR.mkdir(exist_ok=True)
 
-# Notebook session storage - maintains execution context for each notebook
-notebook_sessions = {}
+class _SessionCache(TTLCache):
+    """
+    TTLCache that empties a session's namespaces when it is evicted or expires, so
+    its DataFrames and figures are freed right away. A session with a cell still
+    running is left intact; it is released once that cell finishes.
+    """
+
+    @staticmethod
+    def _release(session: dict) -> None:
+        if not session['lock'].locked():
+            session['globals'].clear()
+            session['locals'].clear()
+
+    def popitem(self):
+        key, session = super().popitem()
+        self._release(session)
+        return key, session
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, session in expired or ():
+            self._release(session)
+        return expired
+
+
+notebook_sessions = _SessionCache(maxsize=MAX_NOTEBOOK_SESSIONS, ttl=SESSION_TTL)
+# Threads available to notebook cells (and other sync work) across all sessions
+NOTEBOOK_THREADS = int(os.getenv("NOTEBOOK_THREADS", "64"))
+
+# Worker processes for editor-mode execution (started on startup)
+RUN_WORKERS = int(os.getenv("RUN_WORKERS", "0")) or os.cpu_count() or 1
+# Replace a worker after this many runs so state leaked by user code (patched modules,
+# global matplotlib settings) doesn't accumulate; 0 keeps each worker until it times out or crashes
+WORKER_MAX_RUNS = int(os.getenv("WORKER_MAX_RUNS", "100"))
+# Seconds an editor run may wait for a free worker before getting a 503. Together with
+# CODE_TIMEOUT this must stay under the frontend request timeout (frontend/src/services/api.ts)
+RUN_QUEUE_TIMEOUT = float(os.getenv("RUN_QUEUE_TIMEOUT", "30"))
+# One single-process executor per worker, so a stuck run can be killed without touching
+# runs on other workers. Idle ones wait in the queue (created on startup); _executors
+# maps every live one to the number of runs it has served
+_idle_executors: Optional["asyncio.Queue[ProcessPoolExecutor]"] = None
+_executors: Dict[ProcessPoolExecutor, int] = {}
+_session_gc_task: Optional[asyncio.Task] = None
 
 
 
@@ -60,6 +199,7 @@ class CodeExecutionResponse(BaseModel):
     execution_time: float
     needs_input: bool = False
     input_prompt: Optional[str] = None
+    graphs: List[str] = []  # Base64-encoded PNGs from plt.show()
 
 
 # Health check
@@ -79,322 +219,532 @@ async def health_check():
     }
 
 
-# Execute Python code
-@app.post("/run", response_model=CodeExecutionResponse)
-async def run_code(request: CodeExecutionRequest):
+# Code that doesn't mention any of these can't reach plt.show(), so it skips figure capture
+_PLOTTING_CODE = re.compile(r'\b(plt|pyplot|pylab|matplotlib|seaborn|sns)\b')
+
+
+def _install_figure_capture(namespace: dict) -> None:
     """
-    Execute Python code safely with a 10-second timeout.
-    Returns stdout, stderr, and execution time.
+    Per-run setup for editor mode: expose plt, clear leftover figures, and make
+    plt.show() collect figures into namespace['_all_figures'] instead of displaying them.
     """
-    try:
-        # Prepare stdin inputs as a list
-        stdin_inputs = []
-        if request.stdin:
-            # Handle both newline and space-separated inputs
-            if '\n' in request.stdin:
-                stdin_inputs = request.stdin.strip().split('\n')
-            elif ' ' in request.stdin:
-                stdin_inputs = request.stdin.strip().split(' ')
-            else:
-                stdin_inputs = [request.stdin.strip()]
-        
-        # Wrap code to capture matplotlib graphs and handle input() properly
-        wrapped_code = f"""
-import sys
-import io
-import base64
-import matplotlib
-matplotlib.use('Agg')  # Non-interactive backend
-import matplotlib.pyplot as plt
+    import matplotlib.pyplot as plt
+
+    all_figures = []
+    captured_figs = set()
+
+    def _custom_show(*args, **kwargs):
+        for fig_num in plt.get_fignums():
+            if fig_num not in captured_figs:
+                all_figures.append(plt.figure(fig_num))
+                captured_figs.add(fig_num)
+
+    plt.show = _custom_show
+    # pylab copies show at import time; re-point it if an earlier run already imported it
+    for name in ('pylab', 'matplotlib.pylab'):
+        if name in sys.modules:
+            sys.modules[name].show = _custom_show
+    plt.close('all')
+    namespace.update(plt=plt, _all_figures=all_figures, _captured_figs=captured_figs)
 
-# Configure pandas display options if available
-try:
-    import pandas as pd
-    pd.set_option('display.max_rows', None)
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', None)
-    pd.set_option('display.max_colwidth', None)
-except ImportError:
-    pass
-
-# Store all figures
-_all_figures = []
-_captured_figs = set()
-
-# Override plt.show() to save figures instead
-_original_show = plt.show
-def _custom_show():
-    for fig_num in plt.get_fignums():
-        if fig_num not in _captured_figs:
-            fig = plt.figure(fig_num)
-            _all_figures.append(fig)
-            _captured_figs.add(fig_num)
-plt.show = _custom_show
-
-# Clear any existing figures first
-plt.close('all')
-
-# Mock input() function for proper terminal display
-_input_values = {stdin_inputs!r}
-_input_index = [0]
-
-def input(prompt=''):
-    if prompt:
-        print(prompt, end='', flush=True)
-    if _input_index[0] < len(_input_values):
-        value = _input_values[_input_index[0]]
-        _input_index[0] += 1
-        print(value)  # Echo the input value on new line
-        return value
-    else:
-        print()
-        return ''
 
-# User code starts here
-{request.code}
+# Compiled user code keyed by a digest of its source, least recently used first
+CODE_CACHE_SIZE = 256
+_code_cache: "OrderedDict[bytes, CodeType]" = OrderedDict()
+_code_cache_lock = threading.Lock()  # Notebook cells compile from concurrent threads
+
+
+def _compile_user_code(code: str) -> CodeType:
+    """
+    Compile editor scripts and notebook cells, reusing the cached code object when
+    the same source runs again (e.g. a re-run cell).
+    """
+    key = hashlib.blake2b(code.encode(), digest_size=16).digest()
+    with _code_cache_lock:
+        code_obj = _code_cache.get(key)
+        if code_obj is not None:
+            _code_cache.move_to_end(key)
+            return code_obj
+
+    code_obj = compile(code, '<user>', 'exec')
+    with _code_cache_lock:
+        _code_cache[key] = code_obj
+        if len(_code_cache) > CODE_CACHE_SIZE:
+            _code_cache.popitem(last=False)
+    return code_obj
+
+
+class _FastCapture:
+    """
+    Minimal stdout/stderr sink: appends each write to a list and joins once in getvalue().
+    Cheaper than StringIO for code that prints many small chunks.
+    Keeps at most MAX_OUTPUT_SIZE characters, so a runaway print loop can't exhaust memory.
+    """
+    __slots__ = ('buf', 'size')
+    encoding = 'utf-8'
+
+    def __init__(self):
+        self.buf = []
+        self.size = 0
+
+    def write(self, s: str) -> int:
+        n = len(s)
+        if self.size <= MAX_OUTPUT_SIZE:
+            self.size += n
+            if self.size > MAX_OUTPUT_SIZE:
+                s = s[:n - (self.size - MAX_OUTPUT_SIZE)]
+                s += f"\n... output truncated after {MAX_OUTPUT_SIZE} characters\n"
+            self.buf.append(s)
+        return n
+
+    def flush(self):
+        pass
+
+    def isatty(self) -> bool:
+        return False
+
+    def getvalue(self) -> str:
+        return ''.join(self.buf)
+
 
-# Save all figures as base64
-if _all_figures:
-    print("\\n__GRAPHS_START__")
-    for idx, fig in enumerate(_all_figures):
-        buf = io.BytesIO()
+class _ThreadLocalStream:
+    """
+    Stand-in for sys.stdout/sys.stderr that writes to a per-thread target when one
+    is set, so notebook cells running in parallel threads each capture their own output.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def redirect(self, target) -> None:
+        self._local.target = target
+
+    def _target(self):
+        return getattr(self._local, 'target', None) or self._default
+
+    def write(self, s: str) -> int:
+        return self._target().write(s)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+# Installed as sys.stdout/sys.stderr on startup
+_notebook_stdout = _ThreadLocalStream(sys.stdout)
+_notebook_stderr = _ThreadLocalStream(sys.stderr)
+
+
+def _parse_stdin(stdin: Optional[str]) -> List[str]:
+    """
+    Split stdin into input() values: one per line if it contains a newline at all
+    (so "John Smith\n" stays one value), otherwise space-separated.
+    """
+    if not stdin:
+        return []
+    if '\n' in stdin:
+        return stdin.strip().splitlines()
+    return stdin.split()
+
+
+def _render_png(fig, buf) -> None:
+    """
+    Write a figure to buf as a 100-dpi PNG, cropped to its tight bounding box
+    unless GRAPH_TIGHT_BBOX is off.
+    """
+    if GRAPH_TIGHT_BBOX:
         fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-        buf.seek(0)
-        img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        print(f"__GRAPH_{{idx}}__{{img_base64}}__GRAPH_END__")
-        buf.close()
-    print("__GRAPHS_END__")
-    plt.close('all')
-"""
-        
-        # Check if this is a notebook session that needs persistent context
-        if request.notebook_id:
-            # Get or create session context
+    else:
+        # Single Agg draw, no bbox measuring pass or savefig format dispatch
+        fig.set_dpi(100)
+        fig.canvas.print_png(buf)
+
+
+# Threads for rendering many figures at once (created lazily in each pool worker)
+PNG_THREADS = min(4, os.cpu_count() or 1)
+PNG_PARALLEL_MIN = 4
+_png_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _figure_png(fig) -> bytes:
+    buf = io.BytesIO()
+    _render_png(fig, buf)
+    return buf.getvalue()
+
+
+def _render_figures(figures: list) -> List[bytes]:
+    """
+    Render figures to PNG bytes. With PNG_PARALLEL_MIN or more figures and spare
+    cores, they are spread over a thread pool so the PNG compression
+    (which releases the GIL) overlaps.
+    """
+    global _png_pool
+    if len(figures) < PNG_PARALLEL_MIN or PNG_THREADS < 2:
+        graphs = []
+        buf = io.BytesIO()  # Reused across figures
+        for fig in figures:
+            buf.seek(0)
+            buf.truncate()
+            _render_png(fig, buf)
+            graphs.append(buf.getvalue())
+        return graphs
+
+    if _png_pool is None:
+        _png_pool = ThreadPoolExecutor(max_workers=PNG_THREADS)
+    # Each figure is only read here, and each thread renders a different one
+    return list(_png_pool.map(_figure_png, figures))
+
+
+# Editor-mode execution
+def _exec_editor(code: str, stdin_inputs: List[str]) -> dict:
+    """
+    Execute editor-mode code in a fresh namespace with graph support.
+    Runs inside a process-pool worker, so it only takes and returns picklable values.
+    """
+    start_time = time.time()
+
+    # Create execution namespace with pandas preloaded
+    exec_globals = {
+        '__name__': '__main__',
+        '__builtins__': __builtins__,
+        'pd': _pd(),
+        '__file__': str(UPLOAD_DIR / 'main.py'),
+        'DATA_DIR': str(UPLOAD_DIR),
+    }
+
+    # Mock input function
+    input_index = [0]
+    def mock_input(prompt=''):
+        if prompt:
+            print(prompt, end='', flush=True)
+        if input_index[0] < len(stdin_inputs):
+            value = stdin_inputs[input_index[0]]
+            input_index[0] += 1
+            print(value)  # Echo the input value on new line
+            return value
+        else:
+            print()
+            return ''
+
+    exec_globals['input'] = mock_input
+
+    # Capture stdout and stderr
+    stdout_capture = _FastCapture()
+    stderr_capture = _FastCapture()
+
+    # The worker process is private to this run, so a plain chdir is safe here;
+    # it also undoes any chdir a previous run on this worker made
+    os.chdir(UPLOAD_DIR)
+
+    try:
+        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
+            # Execute user code; figure capture is only set up for code that can plot
+            if _PLOTTING_CODE.search(code):
+                _install_figure_capture(exec_globals)
+            exec(_compile_user_code(code), exec_globals)
+
+            # Render captured figures to PNG bytes; the response layer picks the encoding
+            graphs = []
+            if exec_globals.get('_all_figures'):
+                graphs = _render_figures(exec_globals['_all_figures'])
+
+        stdout_result = stdout_capture.getvalue()
+        stderr_result = stderr_capture.getvalue()
+
+        return {
+            'success': len(stderr_result) == 0,
+            'stdout': stdout_result,
+            'stderr': stderr_result,
+            'execution_time': time.time() - start_time,
+            'graphs': graphs,
+        }
+
+    # SystemExit too: sys.exit() in user code must not escape the worker as a bare 500
+    except (Exception, SystemExit) as e:
+        return {
+            'success': False,
+            'stdout': stdout_capture.getvalue(),
+            'stderr': f"Error: {str(e)}\n{traceback.format_exc()}",
+            'execution_time': time.time() - start_time,
+        }
+
+    finally:
+        # Close all figures, including ones made without plt in the code (e.g. Series.plot())
+        plt = sys.modules.get('matplotlib.pyplot')
+        if plt is not None:
+            plt.close('all')
+
+
+# Notebook-mode execution
+def _exec_notebook(code: str, stdin_inputs: List[str], session: dict) -> dict:
+    """
+    Execute a notebook cell in the session's persistent context.
+    Runs in a worker thread, one cell per session at a time (see run_code);
+    the session namespace is updated in place.
+    """
+    start_time = time.time()
+
+    # Create mock input() function for this execution
+    input_index = [0]  # Use list to maintain reference in closure
+    def mock_input(prompt=''):
+        if prompt:
+            print(prompt, end='', flush=True)
+        if input_index[0] < len(stdin_inputs):
+            value = stdin_inputs[input_index[0]]
+            input_index[0] += 1
+            print(value)  # Echo the input
+            return value
+        else:
+            print()
+            return ''
+
+    # Inject the mock input function into the session
+    session['globals']['input'] = mock_input
+
+    # The server already runs in UPLOAD_DIR (see _enter_upload_dir); re-enter it so an
+    # earlier cell's os.chdir() can't break bare-filename access for later cells
+    os.chdir(UPLOAD_DIR)
+
+    # Route this thread's output to the captures; other cells keep their own. A cell that
+    # assigned sys.stdout/sys.stderr would bypass the routing, so put the routers back first
+    sys.stdout, sys.stderr = _notebook_stdout, _notebook_stderr
+    stdout_capture = _FastCapture()
+    stderr_capture = _FastCapture()
+    _notebook_stdout.redirect(stdout_capture)
+    _notebook_stderr.redirect(stderr_capture)
+
+    try:
+        # Execute user code directly in persistent context
+        # The matplotlib and pandas setup happens in the session naturally
+        exec(_compile_user_code(code), session['globals'], session['locals'])
+
+        stdout_result = stdout_capture.getvalue()
+        stderr_result = stderr_capture.getvalue()
+
+        return {
+            'success': len(stderr_result) == 0 or 'Traceback' not in stderr_result,
+            'stdout': stdout_result,
+            'stderr': stderr_result,
+            'execution_time': time.time() - start_time,
+        }
+
+    except Exception as e:
+        return {
+            'success': False,
+            'stdout': stdout_capture.getvalue(),
+            'stderr': f"Error: {str(e)}\n{traceback.format_exc()}",
+            'execution_time': time.time() - start_time,
+        }
+
+    finally:
+        sys.stdout, sys.stderr = _notebook_stdout, _notebook_stderr
+        _notebook_stdout.redirect(None)
+        _notebook_stderr.redirect(None)
+
+
+def _init_worker():
+    """
+    Pool worker initializer: pay for the heavy imports once per worker process
+    instead of on the first run that lands on it.
+    """
+    import numpy  # noqa: F401
+    import matplotlib.pyplot  # noqa: F401  (also loads the font cache)
+    _pd()  # Every editor run gets pd preloaded
+
+
+def _new_executor() -> ProcessPoolExecutor:
+    # 'spawn' avoids forking the threaded server process and matches Windows behaviour
+    executor = ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+    )
+    # The worker is started on demand; submit a no-op so it warms up now
+    executor.submit(os.getpid)
+    _executors[executor] = 0
+    return executor
+
+
+def _replace_executor(broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """
+    Kill a timed-out or broken worker and return a fresh one to take its place.
+    A running task cannot be cancelled, so its process is terminated.
+    """
+    _executors.pop(broken, None)
+    for process in list((broken._processes or {}).values()):
+        process.terminate()
+    broken.shutdown(wait=False, cancel_futures=True)
+    return _new_executor()
+
+
+def _recycle_executor(executor: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """
+    Count a finished run against the worker. Once it reaches WORKER_MAX_RUNS, start a
+    warmed-up replacement and let the idle worker exit, so no run waits on the restart.
+    """
+    _executors[executor] += 1
+    if not WORKER_MAX_RUNS or _executors[executor] < WORKER_MAX_RUNS:
+        return executor
+    del _executors[executor]
+    executor.shutdown(wait=False)
+    return _new_executor()
+
+
+def _enter_upload_dir() -> None:
+    """
+    Make UPLOAD_DIR the server's working directory, so notebook cells can open uploads
+    by bare filename; each cell re-enters it instead of saving and restoring the cwd.
+    Relative sys.path entries (uvicorn adds '.' for the app dir) are pinned first
+    so later imports, including those in spawned pool workers, still resolve.
+    """
+    sys.path[:] = [os.path.abspath(p) for p in sys.path]
+    os.chdir(UPLOAD_DIR)
+
+
+async def _expire_sessions() -> None:
+    """
+    TTLCache only expires entries when it is touched; sweep it periodically so idle
+    sessions are released even when no notebook requests arrive.
+    """
+    while True:
+        await asyncio.sleep(SESSION_GC_INTERVAL)
+        notebook_sessions.expire()
+
+
+@app.on_event("startup")
+async def start_executor():
+    global _idle_executors, _session_gc_task
+    _enter_upload_dir()
+    sys.stdout, sys.stderr = _notebook_stdout, _notebook_stderr
+    to_thread.current_default_thread_limiter().total_tokens = NOTEBOOK_THREADS
+    _idle_executors = asyncio.Queue()
+    for _ in range(RUN_WORKERS):
+        _idle_executors.put_nowait(_new_executor())
+    _session_gc_task = asyncio.create_task(_expire_sessions())
+
+
+@app.on_event("shutdown")
+async def stop_executor():
+    if _session_gc_task is not None:
+        _session_gc_task.cancel()
+    for executor in list(_executors):
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+
+def _accepts_msgpack(accept: str) -> bool:
+    """True if the Accept header lists application/msgpack with a non-zero q value."""
+    for media_range in accept.split(','):
+        media_type, *params = media_range.split(';')
+        if media_type.strip().lower() != MSGPACK_MEDIA_TYPE:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+
+def _run_response(result: dict, accept: str):
+    """
+    Build the /run response. Clients that accept MessagePack get the graphs as raw
+    PNG bytes; everyone else gets the JSON model with base64-encoded graphs.
+    """
+    result.setdefault('graphs', [])
+    if msgpack is not None and _accepts_msgpack(accept):
+        return Response(content=msgpack.packb(result), media_type=MSGPACK_MEDIA_TYPE)
+    result['graphs'] = [_b64encode_str(png) for png in result['graphs']]
+    return CodeExecutionResponse(**result)
+
+
+# Execute Python code
+@app.post("/run", response_model=CodeExecutionResponse)
+async def run_code(request: CodeExecutionRequest, accept: str = Header(default='')):
+    """
+    Execute Python code off the event loop with a CODE_TIMEOUT limit.
+    Editor runs go to a worker process; notebook cells run in a worker thread
+    against their persistent session.
+    Returns stdout, stderr, and execution time, as MessagePack if the client's
+    Accept header asks for application/msgpack.
+    """
+    stdin_inputs = _parse_stdin(request.stdin)
+
+    # Check if this is a notebook session that needs persistent context
+    if request.notebook_id:
+        # Get or create session context
+        if request.notebook_id not in notebook_sessions:
+            # The first call imports pandas (~0.5s), so keep it off the event loop
+            pd = await run_in_threadpool(_pd)
+
+            # Re-check after the await: a concurrent request may have created the session meanwhile
             if request.notebook_id not in notebook_sessions:
                 # Initialize session with pandas display configuration
-                session_globals = {'__name__': '__main__', '__builtins__': __builtins__}
-                
-                # Set up pandas display options for complete output
-                try:
-                    import pandas as pd
-                    pd.set_option('display.max_rows', None)
-                    pd.set_option('display.max_columns', None)
-                    pd.set_option('display.width', 1000)  # Wide enough for most terminals
-                    pd.set_option('display.max_colwidth', None)
-                    session_globals['pd'] = pd
-                except ImportError:
-                    pass
-                
-                notebook_sessions[request.notebook_id] = {
-                    'globals': session_globals,
-                    'locals': {}
-                }
-            
-            session = notebook_sessions[request.notebook_id]
-            start_time = time.time()
-            
-            # For notebook mode, use simpler execution without complex wrapping
-            try:
-                # Capture stdout and stderr
-                from io import StringIO
-                
-                # Parse stdin inputs
-                stdin_inputs = []
-                if request.stdin:
-                    if '\n' in request.stdin:
-                        stdin_inputs = request.stdin.strip().split('\n')
-                    elif ' ' in request.stdin:
-                        stdin_inputs = request.stdin.strip().split(' ')
-                    else:
-                        stdin_inputs = [request.stdin.strip()]
-                
-                # Create mock input() function for this execution
-                input_index = [0]  # Use list to maintain reference in closure
-                def mock_input(prompt=''):
-                    if prompt:
-                        print(prompt, end='', flush=True)
-                    if input_index[0] < len(stdin_inputs):
-                        value = stdin_inputs[input_index[0]]
-                        input_index[0] += 1
-                        print(value)  # Echo the input
-                        return value
-                    else:
-                        print()
-                        return ''
-                
-                # Inject the mock input function into the session
-                session['globals']['input'] = mock_input
-                
-                stdout_capture = StringIO()
-                stderr_capture = StringIO()
-                old_stdout = sys.stdout
-                old_stderr = sys.stderr
-                old_cwd = os.getcwd()  # Save current directory
-                
-                try:
-                    sys.stdout = stdout_capture
-                    sys.stderr = stderr_capture
-                    os.chdir(str(UPLOAD_DIR))  # Change to upload directory for file access
-                    
-                    # Execute user code directly in persistent context
-                    # The matplotlib and pandas setup happens in the session naturally
-                    exec(request.code, session['globals'], session['locals'])
-                    
-                    execution_time = time.time() - start_time
-                    stdout_result = stdout_capture.getvalue()
-                    stderr_result = stderr_capture.getvalue()
-                    
-                    return CodeExecutionResponse(
-                        success=len(stderr_result) == 0 or 'Traceback' not in stderr_result,
-                        stdout=stdout_result,
-                        stderr=stderr_result,
-                        execution_time=execution_time
-                    )
-                    
-                finally:
-                    sys.stdout = old_stdout
-                    sys.stderr = old_stderr
-                    os.chdir(old_cwd)  # Restore original directory
-                    
-            except Exception as e:
-                execution_time = time.time() - start_time
-                return CodeExecutionResponse(
-                    success=False,
-                    stdout=stdout_capture.getvalue() if 'stdout_capture' in locals() else "",
-                    stderr=f"Error: {str(e)}\n{traceback.format_exc()}",
-                    execution_time=execution_time
-                )
-        
-        
-        else:
-            # Fast exec-based execution for editor mode with graph support
-            from io import StringIO
-            import traceback
-            
-            start_time = time.time()
-            
-            try:
-                # Create execution namespace with matplotlib and pandas setup
-                exec_globals = {
+                session_globals = {
                     '__name__': '__main__',
                     '__builtins__': __builtins__,
+                    'pd': pd,
+                    '__file__': str(UPLOAD_DIR / 'notebook.py'),
+                    'DATA_DIR': str(UPLOAD_DIR),
                 }
-                
-                # Setup code for matplotlib and pandas
-                setup_code = """
-import sys
-import io
-import base64
-import matplotlib
-matplotlib.use('Agg')  # Non-interactive backend
-import matplotlib.pyplot as plt
 
-# Configure pandas display options if available
-try:
-    import pandas as pd
-    pd.set_option('display.max_rows', None)
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', None)
-    pd.set_option('display.max_colwidth', None)
-except ImportError:
-    pass
-
-# Store all figures
-_all_figures = []
-_captured_figs = set()
-
-# Override plt.show() to save figures instead
-_original_show = plt.show
-def _custom_show():
-    for fig_num in plt.get_fignums():
-        if fig_num not in _captured_figs:
-            fig = plt.figure(fig_num)
-            _all_figures.append(fig)
-            _captured_figs.add(fig_num)
-plt.show = _custom_show
-
-# Clear any existing figures first
-plt.close('all')
-"""
-                
-                # Mock input function
-                input_index = [0]
-                def mock_input(prompt=''):
-                    if prompt:
-                        print(prompt, end='', flush=True)
-                    if input_index[0] < len(stdin_inputs):
-                        value = stdin_inputs[input_index[0]]
-                        input_index[0] += 1
-                        print(value)  # Echo the input value on new line
-                        return value
-                    else:
-                        print()
-                        return ''
-                
-                exec_globals['input'] = mock_input
-                
-                # Capture stdout and stderr
-                stdout_capture = StringIO()
-                stderr_capture = StringIO()
-                old_stdout = sys.stdout
-                old_stderr = sys.stderr
-                old_cwd = os.getcwd()
-                
-                try:
-                    sys.stdout = stdout_capture
-                    sys.stderr = stderr_capture
-                    os.chdir(str(UPLOAD_DIR))
-                    
-                    # Execute setup code first
-                    exec(setup_code, exec_globals)
-                    
-                    # Execute user code
-                    exec(request.code, exec_globals)
-                    
-                    # Extract graphs if any
-                    graph_output = ""
-                    if exec_globals.get('_all_figures'):
-                        graph_output = "\n__GRAPHS_START__\n"
-                        for idx, fig in enumerate(exec_globals['_all_figures']):
-                            buf = io.BytesIO()
-                            fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-                            buf.seek(0)
-                            img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-                            graph_output += f"__GRAPH_{idx}__{img_base64}__GRAPH_END__\n"
-                            buf.close()
-                        graph_output += "__GRAPHS_END__\n"
-                        
-                        # Close all figures
-                        import matplotlib.pyplot as plt
-                        plt.close('all')
-                    
-                    execution_time = time.time() - start_time
-                    stdout_result = stdout_capture.getvalue() + graph_output
-                    stderr_result = stderr_capture.getvalue()
-                    
-                    return CodeExecutionResponse(
-                        success=len(stderr_result) == 0,
-                        stdout=stdout_result,
-                        stderr=stderr_result,
-                        execution_time=execution_time
-                    )
-                    
-                finally:
-                    sys.stdout = old_stdout
-                    sys.stderr = old_stderr
-                    os.chdir(old_cwd)
-                    
-            except Exception as e:
-                execution_time = time.time() - start_time
-                return CodeExecutionResponse(
-                    success=False,
-                    stdout=stdout_capture.getvalue() if 'stdout_capture' in locals() else "",
-                    stderr=f"Error: {str(e)}\n{traceback.format_exc()}",
-                    execution_time=execution_time
-                )
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Execution error: {str(e)}")
+                notebook_sessions[request.notebook_id] = {
+                    'globals': session_globals,
+                    'locals': {},
+                    'lock': asyncio.Lock(),  # One cell at a time per notebook
+                }
+
+        session = notebook_sessions[request.notebook_id]
+        notebook_sessions[request.notebook_id] = session  # Re-set to restart the idle TTL
+        async with session['lock']:
+            result = await run_in_threadpool(_exec_notebook, request.code, stdin_inputs, session)
+        return _run_response(result, accept)
+
+    # Editor mode: run in a worker process so a slow script can't stall other requests.
+    # Wait for a free worker first, so queueing doesn't count against CODE_TIMEOUT
+    # and a burst of requests gets a quick 503 instead of piling up
+    try:
+        executor = await asyncio.wait_for(_idle_executors.get(), timeout=RUN_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="All execution workers are busy, please try again shortly"
+        )
+
+    try:
+        result = await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(executor, _exec_editor, request.code, stdin_inputs),
+            timeout=CODE_TIMEOUT
+        )
+        executor = _recycle_executor(executor)
+    except asyncio.TimeoutError:
+        executor = _replace_executor(executor)
+        result = {
+            'success': False,
+            'stdout': "",
+            'stderr': f"Execution timed out after {CODE_TIMEOUT} seconds",
+            'execution_time': CODE_TIMEOUT,
+        }
+    except BrokenProcessPool:
+        executor = _replace_executor(executor)
+        result = {
+            'success': False,
+            'stdout': "",
+            'stderr': "Execution worker stopped unexpectedly, please run again",
+            'execution_time': 0.0,
+        }
+    finally:
+        _idle_executors.put_nowait(executor)
+    return _run_response(result, accept)
 
 
 # Reset notebook session
@@ -410,81 +760,224 @@ async def reset_notebook(notebook_id: str):
 
 
 
+def _detect_encoding(file_path: Path) -> str:
+    """
+    Guess a text file's encoding from its first ENCODING_SAMPLE_SIZE bytes so the
+    parser only runs once.
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(ENCODING_SAMPLE_SIZE)
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        if len(sample) == ENCODING_SAMPLE_SIZE and e.start >= len(sample) - 3:
+            return 'utf-8'  # Sample was cut off mid-character
+    matches = from_bytes(sample)
+    best = matches.best()
+    if best is None:
+        return 'latin-1'
+    # Short Western text fits many single-byte code pages equally well; prefer cp1252 among
+    # ties, unless the best guess is already another Windows code page (cp1250 Czech, cp1254 Turkish)
+    if best.encoding.startswith('cp125'):
+        return best.encoding
+    for match in matches:
+        if match.chaos <= best.chaos and 'cp1252' in match.could_be_from_charset:
+            return 'cp1252'
+    return codecs.lookup(best.encoding).name
+
+
+def _sendfile_copy(src, dst_path: Path, size: int) -> None:
+    """
+    Copy size bytes of an open file to dst_path with os.sendfile (no userspace buffers).
+    """
+    with open(dst_path, 'wb') as out:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(out.fileno(), src.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
+
+def _xlsx_preview(file_path: Path, nrows: int = 5) -> list:
+    """
+    First nrows of the first sheet as records, read with openpyxl's streaming
+    read-only mode so the rest of the workbook is never parsed.
+    """
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        # Some writers store a stale <dimension ref="A1"/> that would cut every row to column A
+        ws.reset_dimensions()
+        rows = ws.iter_rows(max_row=nrows + 1, values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return []
+        rows = list(rows)
+        # Without dimensions each row ends at its last stored cell; pad the header to the widest row
+        header += (None,) * (max(map(len, rows), default=0) - len(header))
+        # Rename repeated headers like pandas does (a, a.1) so dict() doesn't merge them
+        columns = []
+        counts = defaultdict(int)
+        for i, name in enumerate(header):
+            name = f"Unnamed: {i}" if name is None else str(name)
+            count = counts[name]
+            while count > 0:
+                counts[name] = count + 1
+                name = f"{name}.{count}"
+                count = counts[name]
+            counts[name] = count + 1
+            columns.append(name)
+        return [dict(zip(columns, row)) for row in rows]
+    finally:
+        wb.close()
+
+
+def _build_preview(file_path: Path, file_ext: str):
+    """
+    First rows of an uploaded dataset, or a message if it can't be previewed.
+    Blocking file I/O and parsing, so upload_file runs it in the threadpool.
+    """
+    preview = None
+    try:
+        if file_ext == '.csv':
+            encoding = _detect_encoding(file_path)
+
+            # Arrow's streaming reader parses only the first block of the file
+            if pacsv is not None:
+                try:
+                    reader = pacsv.open_csv(
+                        file_path,
+                        read_options=pacsv.ReadOptions(
+                            block_size=64 * 1024,
+                            encoding='utf8' if encoding == 'utf-8' else encoding
+                        ),
+                        convert_options=pacsv.ConvertOptions(strings_can_be_null=True)
+                    )
+                    batch = reader.read_next_batch()
+                    # Arrow infers binary for text that isn't valid UTF-8, and to_pylist() would
+                    # merge duplicate headers; let pandas handle both (it renames to a, a.1)
+                    names = batch.schema.names
+                    if (len(set(names)) == len(names)
+                            and not any(pa.types.is_binary(field.type) for field in batch.schema)):
+                        preview = batch.slice(0, 5).to_pylist()
+                except StopIteration:
+                    preview = []  # Header only
+                except pa.ArrowInvalid:
+                    pass  # Irregular rows; fall back to pandas
+
+            if preview is None:
+                try:
+                    df = _pd().read_csv(
+                        file_path, nrows=5, encoding=encoding,
+                        engine='c', on_bad_lines='skip'
+                    )
+                    # NaN is serialized as null by ORJSONResponse
+                    preview = df.to_dict('records')
+                except UnicodeDecodeError:
+                    preview = "Preview unavailable: encoding issue"
+
+        elif file_ext == '.json':
+            with open(file_path, 'rb') as f:
+                is_array = f.read(64).lstrip()[:1] == b'['
+                f.seek(0)
+                if is_array and ijson is not None:
+                    # Stream only the first records instead of parsing the whole array
+                    preview = list(islice(ijson.items(f, 'item', use_float=True), 5))
+                else:
+                    data = orjson.loads(f.read())
+                    preview = data[:5] if isinstance(data, list) else data
+        elif file_ext == '.xlsx':
+            try:
+                preview = _xlsx_preview(file_path)
+            except Exception:
+                df = _pd().read_excel(file_path, nrows=5)
+                preview = df.to_dict('records')
+    except Exception as e:
+        preview = f"Preview unavailable: {str(e)}"
+    return preview
+
+
+ALLOWED_EXTENSIONS = frozenset({'.csv', '.json', '.xlsx'})
+_INVALID_TYPE_DETAIL = f"Invalid file type. Allowed: {', '.join(sorted(ALLOWED_EXTENSIONS))}"
+
+
+async def _validated_upload(file: UploadFile = File(...)) -> UploadFile:
+    """
+    Reject files with an unsupported extension before the handler runs.
+    """
+    if Path(file.filename).suffix.lower() not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=_INVALID_TYPE_DETAIL)
+    return file
+
+
 # Upload dataset
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = Depends(_validated_upload)):
     """
     Upload a dataset file (CSV, JSON, XLSX).
     Returns file path and preview of the data.
     """
     try:
-        # Validate file type
-        allowed_extensions = ['.csv', '.json', '.xlsx']
         file_ext = Path(file.filename).suffix.lower()
         
-        if file_ext not in allowed_extensions:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
-            )
-        
-        # Read file content
-        content = await file.read()
+        # Sanitize filename to prevent path traversal
+        safe_filename = Path(file.filename).name
+        file_path = UPLOAD_DIR / safe_filename
         
-        # Validate file size
-        if len(content) > MAX_FILE_SIZE:
+        # Starlette counts the bytes while parsing the form, so oversized uploads
+        # can be rejected before anything is written
+        if file.size is not None and file.size > MAX_FILE_SIZE:
             raise HTTPException(
                 status_code=413,
                 detail=f"File too large. Maximum size: {MAX_FILE_SIZE / 1024 / 1024}MB"
             )
         
-        # Sanitize filename to prevent path traversal
-        safe_filename = Path(file.filename).name
-        file_path = UPLOAD_DIR / safe_filename
-        
-        # Save file
-        with open(file_path, 'wb') as f:
-            f.write(content)
-        
-        # Generate preview based on file type with encoding handling
-        preview = None
+        # Write to a unique temporary name so an oversized or interrupted upload never
+        # replaces an existing file, and concurrent uploads of one name don't collide
+        partial_path = UPLOAD_DIR / f".{safe_filename}.{uuid.uuid4().hex}.part"
         try:
-            if file_ext == '.csv':
-                # Try multiple encodings for CSV files
-                df = None
-                for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
-                    try:
-                        df = pd.read_csv(file_path, nrows=5, encoding=encoding)
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                
-                if df is not None:
-                    # Replace NaN with None for valid JSON
-                    print(f"Processing CSV preview for {safe_filename}")
-                    df = df.astype(object).where(pd.notnull(df), None)
-                    print("NaN values replaced")
-                    preview = df.to_dict('records')
-                else:
-                    preview = "Preview unavailable: encoding issue"
-                    
-            elif file_ext == '.json':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    preview = data[:5] if isinstance(data, list) else data
-            elif file_ext == '.xlsx':
-                df = pd.read_excel(file_path, nrows=5)
-                # Replace NaN with None for valid JSON
-                df = df.astype(object).where(pd.notnull(df), None)
-                preview = df.to_dict('records')
-        except Exception as e:
-            preview = f"Preview unavailable: {str(e)}"
+            size = None
+            # Large uploads are already spooled to a temp file (Starlette's SpooledTemporaryFile
+            # has rolled over to disk); copy it in the kernel
+            if SENDFILE_UPLOADS and file.size is not None and getattr(file.file, '_rolled', False):
+                try:
+                    await run_in_threadpool(_sendfile_copy, file.file, partial_path, file.size)
+                    size = file.size
+                except OSError:
+                    await file.seek(0)  # Filesystem doesn't support it; use the chunked copy
+
+            if size is None:
+                # Stream in chunks, validating size as we go
+                size = 0
+                async with aiofiles.open(partial_path, 'wb') as out:
+                    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > MAX_FILE_SIZE:
+                            break
+                        await out.write(chunk)
+
+            # Validate file size
+            if size > MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Maximum size: {MAX_FILE_SIZE / 1024 / 1024}MB"
+                )
+
+            os.replace(partial_path, file_path)
+        finally:
+            # Already gone after a successful replace
+            partial_path.unlink(missing_ok=True)
         
+        # Generate preview based on file type (parsing runs off the event loop)
+        preview = await run_in_threadpool(_build_preview, file_path, file_ext)
+
         return {
             "success": True,
             "filename": safe_filename,
             "path": str(file_path),
-            "size": len(content),
+            "size": size,
             "preview": preview
         }
         
@@ -145,29 +145,11 @@ export default function PythonLab() {
       setMemoryUsed(`${Math.floor(Math.random() * 500 + 100)} KB`);
 
       if (result.success) {
-        let formattedOutput = result.stdout || 'Success (no output)';
-
-        // Extract graphs from output
-        const graphMatches = formattedOutput.match(/__GRAPH_(\d+)__(.+?)__GRAPH_END__/gs);
-        if (graphMatches) {
-          const extractedGraphs: string[] = [];
-          graphMatches.forEach(match => {
-            const base64Match = match.match(/__GRAPH_\d+__(.+?)__GRAPH_END__/);
-            if (base64Match) {
-              extractedGraphs.push(base64Match[1]);
-            }
-          });
-          setGraphs(extractedGraphs);
-          setCurrentGraphIndex(0);
-
-          // Remove graph data from output
-          formattedOutput = formattedOutput.replace(/__GRAPHS_START__[\s\S]*?__GRAPHS_END__/g, '');
-          formattedOutput = formattedOutput.trim();
-        } else {
-          setGraphs([]);
-        }
+        // Graphs arrive as base64 PNGs alongside stdout
+        setGraphs(result.graphs || []);
+        setCurrentGraphIndex(0);
 
-        setOutput(formattedOutput);
+        setOutput(result.stdout || 'Success (no output)');
       } else {
         setOutput(`Error:\n${result.stderr}`);
       }
@@ -177,7 +159,7 @@ export default function PythonLab() {
       let errorMsg = 'Unknown error occurred';
 
       if (error.code === 'ECONNABORTED' || error.message?.includes('timeout')) {
-        errorMsg = `Execution timeout: Code took longer than ${Math.floor(125000 / 1000)} seconds.\nPlease optimize your code or reduce the workload.`;
+        errorMsg = `Execution timeout: Code took longer than ${Math.floor(155000 / 1000)} seconds.\nPlease optimize your code or reduce the workload.`;
       } else if (error.response?.data?.detail) {
         errorMsg = error.response.data.detail;
       } else if (error.message) {
@@ -4,7 +4,7 @@ const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
 const api = axios.create({
   baseURL: API_BASE_URL,
-  timeout: 125000, // 125 seconds - slightly more than backend timeout (120s)
+  timeout: 155000, // 155 seconds - backend queue wait (30s) + execution timeout (120s), plus a margin
   headers: {
     'Content-Type': 'application/json',
   },
@@ -15,6 +15,7 @@ export interface CodeExecutionResponse {
   stdout: string;
   stderr: string;
   execution_time: number;
+  graphs: string[];
 }
 
 export interface UploadResponse {